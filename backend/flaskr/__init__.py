@@ -1,27 +1,132 @@
 import os
-from flask import Flask, request, abort, jsonify
+from flask import Flask, Request, Response, request, abort
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
+from sqlalchemy import ARRAY, Integer, bindparam, cast, func, select
+from sqlalchemy.ext import baked
+from sqlalchemy.exc import SQLAlchemyError
+from dataclasses import dataclass
+from typing import Optional
+import time
+import orjson
 
-from models import setup_db, Question, Category
+from models import setup_db, db, Question, Category
 
 QUESTIONS_PER_PAGE = 10
 
-# helper method to put 10 questions per page
-def paginate_questions(request, selection):
-    page = request.args.get("page", 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
+# errors from a failed DB statement or bad values - these become a 422,
+# anything else (including abort()'s HTTPExceptions) propagates unchanged
+# request body shape is checked explicitly in each endpoint instead
+UNPROCESSABLE_ERRORS = (SQLAlchemyError, KeyError, ValueError)
+
+# cache of compiled statements for the hot, fixed-shape queries (question
+# counts and the quiz) - each is only built and compiled to SQL once
+# baked queries need a real Session, so run them with db.session() - the
+# scoped_session proxy doesn't expose the attributes they read
+bakery = baked.bakery()
+
+# columns needed to format a question - list endpoints select only these
+# as plain rows, skipping full ORM object hydration and the identity map
+QUESTION_COLUMNS = (Question.id, Question.question, Question.answer,
+                    Question.category, Question.difficulty)
+
+# per-process cache of {category id: type} - categories rarely change,
+# so they are only reloaded from the DB every CATEGORY_CACHE_TTL seconds
+CATEGORY_CACHE_TTL = 60
+_CAT_CACHE = {'t': 0, 'v': None}
+
+# helper method to put 10 questions per page - LIMIT/OFFSET are done in SQL,
+# so only the requested page is loaded from the DB
+# if an 'after' cursor (last question id seen) is given, seek past it on the
+# primary key instead of using OFFSET - 'page' is kept for backwards compat
+# query should select QUESTION_COLUMNS, e.g. db.session.query(*QUESTION_COLUMNS)
+def paginate_questions(request, query):
+    current_questions, _ = paginate_questions_with_cursor(request, query)
 
     return current_questions
 
+# same as paginate_questions, but also returns the id to pass back as ?after=
+# for the next page - one extra row is fetched to tell if there is a next page,
+# so next_cursor is None on the last page
+def paginate_questions_with_cursor(request, query):
+    after_id = request.args.get("after", type=int)
+    query = query.order_by(Question.id.asc())
+    
+    if after_id is not None:
+        query = query.filter(Question.id > after_id)
+    else:
+        # pages start at 1 - a negative OFFSET is rejected by PostgreSQL
+        page = max(request.args.get("page", 1, type=int), 1)
+        query = query.offset((page - 1) * QUESTIONS_PER_PAGE)
+    
+    selection = query.limit(QUESTIONS_PER_PAGE + 1).all()
+    current_questions = [row._asdict() for row in selection[:QUESTIONS_PER_PAGE]]
+    
+    if len(selection) > QUESTIONS_PER_PAGE:
+        next_cursor = current_questions[-1]['id']
+    else:
+        next_cursor = None
+
+    return current_questions, next_cursor
+
+# response body for GET /questions - orjson serializes dataclasses natively,
+# straight from the attributes, without building an intermediate dict
+@dataclass
+class QuestionsResponse:
+    success: bool
+    categories: dict
+    total_questions: int
+    questions: list
+    next_cursor: Optional[int]
+
+# helper method to count all questions with a baked query
+def count_questions():
+    return bakery(lambda session: session.query(func.count(Question.id)))(db.session()).scalar()
+
+# helper method to get the cached category dict, reloading it once the TTL expires
+# set _CAT_CACHE['t'] = 0 to invalidate it if categories are ever changed
+def _get_cat_dict(ttl=CATEGORY_CACHE_TTL):
+    now = time.monotonic()
+    if not _CAT_CACHE['v'] or now - _CAT_CACHE['t'] > ttl:
+        _CAT_CACHE['v'] = {cat.id: cat.type for cat in Category.query.all()}
+        _CAT_CACHE['t'] = now
+    return _CAT_CACHE['v']
+
+# helper method to serialize responses with orjson instead of jsonify
+# payload can be a dict or a response dataclass
+# (category ids are int keys, so non-str keys must be allowed)
+def ojsonify(payload, status=200):
+    return Response(orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS),
+                    status=status, mimetype='application/json')
+
+# request class that parses JSON bodies with orjson instead of the stdlib parser
+# the parsed body is cached in _cached_json the same way Flask's get_json does
+class OrjsonRequest(Request):
+    def get_json(self, force=False, silent=False, cache=True):
+        if cache and self._cached_json[silent] is not Ellipsis:
+            return self._cached_json[silent]
+        if not (force or self.is_json):
+            return None
+        try:
+            rv = orjson.loads(self.get_data(cache=cache))
+        except orjson.JSONDecodeError as e:
+            if cache and silent:
+                normal_rv, _ = self._cached_json
+                self._cached_json = (normal_rv, None)
+            if silent:
+                return None
+            return self.on_json_loading_failed(e)
+        if cache:
+            self._cached_json = (rv, rv)
+        return rv
+
 # create and configure the app
 def create_app(test_config=None):
     app = Flask(__name__)
+    app.request_class = OrjsonRequest
+    # keep any jsonify output compact and unsorted, even in debug mode
+    app.config['JSONIFY_PRETTYPRINT_REGULAR'] = False
+    app.config['JSON_SORT_KEYS'] = False
     setup_db(app)
     # setup CORS
     CORS(app, resources={"/": {"origins": "*"}})
@@ -40,12 +145,7 @@ def create_app(test_config=None):
     # return all categories
     @app.route('/categories')
     def get_categories():
-        categories = Category.query.all()
-        
-         # fix for error of Category not JSON serializable
-        cat_dict = {}
-        for cat in categories:
-            cat_dict[cat.id] = cat.type
+        cat_dict = _get_cat_dict()
         
         # if no categories are found - send to error
         if (len(cat_dict) == 0):
@@ -55,7 +155,7 @@ def create_app(test_config=None):
                  'categories': cat_dict,
                  'total_categories': len(cat_dict)}
             
-        return jsonify(result)
+        return ojsonify(result)
 
 
 # Endpoint to handle GET requests for questions,including pagination (every 10 questions).
@@ -64,28 +164,22 @@ def create_app(test_config=None):
     @app.route('/questions')
     def get_questions():
         
-        questions = Question.query.all()
-        total_questions = len(questions)
+        total_questions = count_questions()
         
-        # gets 10 questions/page
-        current_questions = paginate_questions(request, questions)
+        # gets 10 questions/page, and the cursor for the next page
+        current_questions, next_cursor = paginate_questions_with_cursor(
+            request, db.session.query(*QUESTION_COLUMNS))
         
-        # fix for error of Category not JSON serializable
-        cat_dict = {}
-        categories = Category.query.all()
-        for cat in categories:
-            cat_dict[cat.id] = cat.type
+        cat_dict = _get_cat_dict()
         
         # check for error of empty DBs
         if ((len(current_questions) == 0) or (len(cat_dict) == 0)):
             abort(404)
         
-        result = {'success': True,
-                 'categories': cat_dict,
-                 'total_questions': total_questions,
-                 'questions': current_questions}
+        result = QuestionsResponse(True, cat_dict, total_questions,
+                                   current_questions, next_cursor)
             
-        return jsonify(result)  
+        return ojsonify(result)  
 
 
 # When you click the trash icon next to a question, the question will be removed. 
@@ -94,27 +188,29 @@ def create_app(test_config=None):
     @app.route('/questions/<int:question_id>', methods=['DELETE'])
     def delete_question(question_id):
         try:
-            # selecting question - if ID not found, vqriable question is set to None
-            question = Question.query.filter(Question.id == question_id).one_or_none()
+            # delete question from DB with a single DELETE - no SELECT first,
+            # if ID not found, no rows are deleted
+            deleted = Question.query.filter(Question.id == question_id).delete(synchronize_session=False)
+            db.session.commit()
             
-            # delete question from DB
-            question.delete()
+            if deleted == 0:
+                abort(422)
             
-            # getting all reamining questions for display
-            selection = Question.query.order_by(Question.id).all()
-            current_questions = paginate_questions(request, selection)
+            # getting the page of remaining questions for display
+            current_questions = paginate_questions(request, db.session.query(*QUESTION_COLUMNS))
             
             result = {
                 'success': True,
                 'question_deleted': question_id,
-                'total_questions': len(Question.query.all()),
+                'total_questions': count_questions(),
                 'questions': current_questions
             }
             
-            return jsonify(result)
+            return ojsonify(result)
         
-        except:
+        except UNPROCESSABLE_ERRORS:
             # unprocessible request
+            db.session.rollback()
             abort(422)
         
 # Endpoint to POST a new question, which will require the question and answer text, category, and difficulty score.
@@ -127,6 +223,9 @@ def create_app(test_config=None):
         # get form body
         body = request.get_json()
         
+        if not isinstance(body, dict):
+            abort(422)
+        
         # variables will either have the value from the form OR None, which is what we will filter on to determine if it's a valid ADD
         
         new_question = body.get('question', None)
@@ -141,8 +240,8 @@ def create_app(test_config=None):
             # if there's a search term, enter this 'if' block
             if search_term:
                 
-                # get all questions with search term
-                selection = Question.query.order_by(Question.id).filter(Question.question.ilike(f'%{search_term}%')).all()
+                # query for all questions with search term
+                selection = db.session.query(*QUESTION_COLUMNS).filter(Question.question.ilike(f'%{search_term}%'))
             
                 # paginate found questions with search term
                 current_questions = paginate_questions(request, selection)
@@ -152,12 +251,13 @@ def create_app(test_config=None):
                     result = {
                         'success': True,
                         'questions': current_questions,
-                        'total questions in search': len(selection)
+                        'total questions in search': selection.with_entities(func.count(Question.id)).scalar()
                     }
                     
-                    return jsonify(result)
+                    return ojsonify(result)
                 else:
-                    abort(500)
+                    # no matches - unprocessable search, not a server error
+                    abort(422)
                     
             # no search term, create new question
             else:
@@ -166,26 +266,31 @@ def create_app(test_config=None):
                 if ((new_question is None) or (new_answer is None) or (new_difficulty is None) or (new_category is None)):
                     abort(422)
                 
-                # if valid fields are populated, create new question
-                created_question = Question(new_question, new_answer, new_difficulty, new_category)
-
-                # adds to DB
-                created_question.insert()
+                # if valid fields are populated, insert new question in one
+                # INSERT ... RETURNING id, without an ORM flush
+                created_id = db.session.execute(
+                    Question.__table__.insert().values(
+                        question=new_question,
+                        answer=new_answer,
+                        difficulty=new_difficulty,
+                        category=new_category
+                    ).returning(Question.id)
+                ).scalar()
+                db.session.commit()
 
                 #reload questions on page
-                selection = Question.query.order_by(Question.id).all()
-                
-                current_questions = paginate_questions(request, selection)
+                current_questions = paginate_questions(request, db.session.query(*QUESTION_COLUMNS))
 
                 result = {
                     'success': True,
-                    'created': created_question.id,
-                    'total_questions': len(Question.query.all()),
+                    'created': created_id,
+                    'total_questions': count_questions(),
                     'questions': current_questions
                 }
-                return jsonify(result)
+                return ojsonify(result)
             
-        except:
+        except UNPROCESSABLE_ERRORS:
+            db.session.rollback()
             abort(422)
     
 
@@ -194,14 +299,14 @@ def create_app(test_config=None):
     @app.route('/categories/<int:cat_id>/questions')
     def list_questions_by_category(cat_id):
         
-        # gets category requested
-        current_category = Category.query.filter_by(id=cat_id).one_or_none()
+        # gets category requested by primary key
+        current_category = Category.query.get(cat_id)
         
         if current_category is None:
             abort(422)
         
         # gets questions from requested category
-        selection = Question.query.filter_by(category=current_category.id).all()
+        selection = db.session.query(*QUESTION_COLUMNS).filter(Question.category == current_category.id)
         current_questions = paginate_questions(request, selection)
         
         result = {
@@ -211,7 +316,7 @@ def create_app(test_config=None):
             'questions': current_questions
         }
         
-        return jsonify(result)
+        return ojsonify(result)
         
 
     #POST endpoint to get questions to play the quiz. 
@@ -222,75 +327,88 @@ def create_app(test_config=None):
         try:
             body = request.get_json()
 
+            if not isinstance(body, dict):
+                abort(422)
+
             # 'All' is id 0 AND this is a dictionary
             category = body.get('quiz_category')
 
             # looks like this is an array of questions
             previous_questions = body.get('previous_questions')
 
-            # check for 'All' category or specific category and get all available questions
-            if (category['id']== 0):
-                questions = Question.query.filter(Question.id.notin_(previous_questions)).all()
+            # category must have an id, previous_questions is required, even if it's empty
+            if not isinstance(category, dict) or 'id' not in category:
+                abort(422)
+            if not isinstance(previous_questions, list):
+                abort(422)
+
+            # baked query - values are bound as params, so the SQL for each
+            # combination of the filters below is compiled once and cached
+            questions = bakery(lambda session: session.query(Question))
+            params = {}
+
+            # check for 'All' category or specific category
+            if (category['id'] != 0):
+                questions += lambda q: q.filter(Question.category == bindparam('category_id'))
+                params['category_id'] = category['id']
                 
-            # else grab only questions from selected category that are not in previously used
-            else:
-                questions = Question.query.filter_by(category = category['id']).filter(Question.id.notin_(previous_questions)).all()
+            # only questions that are not in previously used - sent as one int[]
+            # parameter and unnested, rather than an N-element IN list
+            if previous_questions:
+                questions += lambda q: q.filter(~Question.id.in_(
+                    select([func.unnest(cast(bindparam('previous_ids'), ARRAY(Integer)))])))
+                params['previous_ids'] = previous_questions
                 
-        # 1. checks if there are remaining questions
-        # 2. if so, makes the current question a question from remaining questions with a random index
-        # 3. else, makes the current question - None to end the game
-        # 4. returns: success is true and the current question
-            
-            # helper method to get random index number
-            def random_index():
-                return random.randrange(0, len(questions))
+        # 1. picks one random remaining question in SQL, so only one row is loaded
+        # 2. if there are none left, makes the current question - None to end the game
+        # 3. returns: success is true and the current question
             
-            if len(questions) > 0:
-                current_question = questions[random_index()].format() 
-            else:
-                current_question = None
+            questions += lambda q: q.order_by(func.random())
+            question = questions(db.session()).params(**params).first()
+            current_question = question.format() if question else None
             
-            return jsonify({
+            return ojsonify({
                 'success':True,
                 'question': current_question
             })
             
         
-        except:
+        except UNPROCESSABLE_ERRORS:
+            db.session.rollback()
             abort(422)
                  
     
     # error handlers
     @app.errorhandler(400)
     def bad_request(error):
-        return jsonify ({
+        return ojsonify({
             'success': False,
             'error': 400,
             'message': 'Cannot handle this request'
-        }), 400
+        }, status=400)
     
     @app.errorhandler(404)
     def not_found(error):
-        return jsonify ({
+        return ojsonify({
             'success': False,
             'error': 404,
             'message': 'Cannot find resource for this request'
-        }), 404
+        }, status=404)
     
     @app.errorhandler(422)
     def unprocessable(error):
-        return jsonify ({
+        return ojsonify({
             'success': False,
             'error': 422,
             'message': 'Cannot process this request'
-        }), 422
+        }, status=422)
     
     @app.errorhandler(500)
     def internal_server_error(error):
-        return jsonify ({
+        return ojsonify({
             'success': False,
             'error': 500,
             'message': 'Internal server error - cannot process request'
-        }), 500
+        }, status=500)
 
     return app
@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+from sqlalchemy import Column, String, Integer, Index, create_engine
 from flask_sqlalchemy import SQLAlchemy
 from settings import DB_NAME, DB_USER, DB_PASSWORD
 import json
@@ -32,6 +32,9 @@ class Question(db.Model):
     category = Column(String)
     difficulty = Column(Integer)
 
+    # category filters (category questions, quizzes) seek this index in id order
+    __table_args__ = (Index('ix_questions_category_id', 'category', 'id'),)
+
     def __init__(self, question, answer, category, difficulty):
         self.question = question
         self.answer = answer
@@ -57,6 +57,48 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(data['total_questions'])
         self.assertTrue(len(data["questions"]))
     
+    def test_get_questions_after_cursor(self):
+        first = json.loads(self.client().get('/questions').data)
+        res = self.client().get('/questions?after={}'.format(first['next_cursor']))
+        data = json.loads(res.data)
+        
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertTrue(data['questions'][0]['id'] > first['next_cursor'])
+    
+    def test_get_questions_after_cursor_last_page(self):
+        # pad the table to a multiple of 10 questions, so the last page is full
+        added = []
+        for _ in range((10 - len(Question.query.all()) % 10) % 10):
+            q = Question(question="what is love?", answer="baby, don't hurt me", category=1, difficulty=3)
+            q.insert()
+            added.append(q)
+        last_id = Question.query.order_by(Question.id.desc()).first().id
+        
+        data = json.loads(self.client().get('/questions').data)
+        
+        # follow the cursor until the last page
+        while data['next_cursor'] is not None:
+            res = self.client().get('/questions?after={}'.format(data['next_cursor']))
+            data = json.loads(res.data)
+            self.assertEqual(res.status_code, 200)
+        
+        for q in added:
+            q.delete()
+        
+        self.assertEqual(data['success'], True)
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(data['questions'][-1]['id'], last_id)
+    
+    def test_get_questions_page_below_one_returns_first_page(self):
+        first = json.loads(self.client().get('/questions').data)
+        res = self.client().get('/questions?page=0')
+        data = json.loads(res.data)
+        
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual(data['questions'], first['questions'])
+    
     def test_404_error_get_questions_paginated_no_page_exists(self):
         res = self.client().get('/questions?page=9999999')
         data = json.loads(res.data)
@@ -121,9 +163,13 @@ class TriviaTestCase(unittest.TestCase):
         
         after = len(Question.query.all())
         
+        created = Question.query.get(data['created'])
+        
         self.assertEqual(res.status_code, 200)
         self.assertEqual(data['success'], True)
         self.assertTrue(after > before)
+        self.assertEqual(int(created.category), 3)
+        self.assertEqual(created.difficulty, 1)
     
     def test_422_error_incomplete_form_data(self):
         
@@ -191,6 +237,42 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(data['success'], True)
         self.assertTrue(data['question'], True)
         
+    def test_play_quiz_skips_previous_questions(self):
+        ids = [q.id for q in Question.query.filter(Question.category == 1).all()]
+        previous = ids[:-1]
+        
+        test_quiz = {
+            'previous_questions': previous,
+            'quiz_category': {
+                'type': 'Science',
+                'id': 1
+            }}
+        
+        res = self.client().post('/quizzes', json=test_quiz)
+        data = json.loads(res.data)
+        
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertNotIn(data['question']['id'], previous)
+        self.assertEqual(data['question']['id'], ids[-1])
+    
+    def test_play_quiz_all_previous_questions_ends_game(self):
+        ids = [q.id for q in Question.query.filter(Question.category == 1).all()]
+        
+        test_quiz = {
+            'previous_questions': ids,
+            'quiz_category': {
+                'type': 'Science',
+                'id': 1
+            }}
+        
+        res = self.client().post('/quizzes', json=test_quiz)
+        data = json.loads(res.data)
+        
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertIsNone(data['question'])
+        
     def test_422_play_quiz_fails(self):
         # removed 'previous_questions'
         test_quiz = {
@@ -205,6 +287,14 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 422)
         self.assertEqual(data['success'], False)
         self.assertEqual(data['message'], 'Cannot process this request')
+
+    def test_400_play_quiz_malformed_json(self):
+        res = self.client().post('/quizzes', data='{"previous_questions": [', content_type='application/json')
+        data = json.loads(res.data)
+        
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(data['message'], 'Cannot handle this request')
   
 
 # Make the tests conveniently executable